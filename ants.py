@@ -1,5 +1,5 @@
 import numpy as np
-from math import pi,cos,sin,sqrt
+from math import pi,cos,sin,sqrt,tan,log,ceil
 import simulation as sim
 from itertools import cycle,compress
 
@@ -47,6 +47,11 @@ class Ant:
     def getNextPosition(self):
         return self.nextPos
 
+    def setPosition(self, position):
+        """Move the ant directly to the [x,y] `position`"""
+        self.p = np.array(position)
+        self.nextPos = None
+
     def step(self):
         """Advance the position of the ant"""
         if(self.nextPos is None):
@@ -154,15 +159,55 @@ class AntGroup:
         dt: float
             The interval of time that should pass in this timestep
         """
-        # set the next positions of the ants
+        self.setNextPositions(dt)
+        self.advance(dt)
+
+    def setNextPositions(self, dt):
+        """
+        Computes the next position of every ant without moving them
+
+        dt: float
+            The interval of time that should pass in this timestep
+        """
         for ant in self.ants:
             ant.setNextPosition(dt)
-        # step all the ants forward
+
+    def getNextPositions(self):
+        """
+        Returns a matrix of the next x,y positions of ants in the same
+        layout as `getPositions`
+        """
+        positions = [[],[]]
+        for ant in self.ants:
+            x,y = ant.getNextPosition()
+            positions[0].append(x)
+            positions[1].append(y)
+        return positions
+
+    def advance(self, dt):
+        """
+        Moves every ant to its next position and advances the time
+
+        dt: float
+            The interval of time that was used to compute the next positions
+        """
         for ant in self.ants:
             ant.step()
-        # advance the time
         self.timeElapsed += dt
 
+    def setPositions(self, positions, timeElapsed):
+        """
+        Places the ants directly, e.g. on an interpolated state
+
+        positions: list-type
+            Matrix of x,y positions in the same layout as `getPositions`
+        timeElapsed: float
+            The time that corresponds to `positions`
+        """
+        for ant,x,y in zip(self.ants, positions[0], positions[1]):
+            ant.setPosition([x,y])
+        self.timeElapsed = timeElapsed
+
     def getNumberOfAnts(self):
         return self.n
 
@@ -202,6 +247,23 @@ class Ngon:
 
         return points
 
+def _distanceBetweenAnts(positions):
+    """
+    Distance between the first two ants of a matrix of x,y positions laid
+    out like `AntGroup.getPositions`. See
+    `AntGroup.getDistanceBetweenAnts`.
+    """
+    return sqrt((positions[0][0]-positions[0][1])**2 +
+            (positions[1][0]-positions[1][1])**2)
+
+def _grow(array, length):
+    """
+    Returns a copy of `array` extended with zeros to `length` rows
+    """
+    grown = np.zeros((length,) + array.shape[1:])
+    grown[:len(array)] = array
+    return grown
+
 class SimulationManager:
     """
     Manages the simulation. Basically, pre-computes the simulation 
@@ -210,13 +272,27 @@ class SimulationManager:
     REQUIRES: All the ants are moving at the same speed.
 
     INVARIANTS:
-        1. The distance between the ants is not aproximately equal 0
+        1. While the ants are stepped, the distance between them is not
+           below CLOSE_OUT_DISTANCE. Only the analytical close out goes
+           further, and with tolerance 0 it puts every ant on the center.
     """
-    def __init__(self, antGroup=None, maxFrames=2**14,
-            frameReductionFactor=1, alpha=None):
+    # smallest distance between the ants that the stepping goes down to.
+    # Smaller tolerances are reached on the analytical solution.
+    CLOSE_OUT_DISTANCE = 0.0001
+    # number of bisections used to locate the crossing within a step
+    BISECTIONS = 64
+    # extra room allocated on top of the estimated number of frames
+    FRAME_MARGIN = 1.05
+    MIN_EXTRA_FRAMES = 8
+
+    def __init__(self, antGroup=None, maxFrames=None,
+            frameReductionFactor=1, alpha=None, tolerance=0.0001):
         """
         antGroup: AntGroup
             The group of ants this manager is handling.
+        maxFrames: int
+            Upper limit on the number of frames recorded, or None to run
+            until the ants reach the tolerance.
         positions,elapsedTimes,distances: nd-arrays
             Accumulate data as the simulation goes.
         alpha: float
@@ -225,9 +301,18 @@ class SimulationManager:
             should the ants move with the next step. E.g. alpha = 1/10, then
             with each step, the ants move forward 10% of the distance between
             the ant infront of it.
+        tolerance: float
+            REQUIRES: tolerance >= 0
+            The simulation ends when the distance between the ants reaches
+            this value. The crossing is located within the last step, and
+            the final frame holds the state at that moment. Tolerances
+            below CLOSE_OUT_DISTANCE add an analytical tail, see
+            `_closeOut`.
         """
         if int(frameReductionFactor) < 1:
             raise ValueError("Reduction factor must be > 1")
+        if tolerance < 0:
+            raise ValueError("Tolerance must be >= 0")
         self.antGroup = antGroup
         self.positions = None
         self.elpasedTimes = None
@@ -236,47 +321,172 @@ class SimulationManager:
         self.frameReductionFactor = int(frameReductionFactor)
         self.numFramesUsed = None
         self.alpha = alpha
+        self.tolerance = tolerance
+        self.endTime = None
 
     def _getDtForNextStep(self):
+        """
+        Raises AntsReachedEndException once the ants are within
+        CLOSE_OUT_DISTANCE, where the stepping ends.
+        """
         if self.alpha is None:
             raise ValueError("Must set alpha first")
         # distance between the ants
         distance = self.antGroup.getDistanceBetweenAnts()
         # ensure class invariant
-        if(distance < 0.0001):
+        if(distance <= self.CLOSE_OUT_DISTANCE):
             raise AntsReachedEndException
         # return the timestep
         return self.alpha/sim.SPEED*distance
 
+    def _getClosingSpeed(self):
+        """
+        The constant speed v(1 - sin(a)) at which the distance between the
+        ants closes in the analytical solution (see README)
+        """
+        phi = Ngon(self.antGroup.getNumberOfAnts()).getInteriorAngle()
+        return sim.SPEED*(1 - sin(phi - pi/2))
+
     def _step(self):
-        dt = self._getDtForNextStep()
-        self.antGroup.step(dt)
+        """
+        Advances the ants one time step forward. If the distance between
+        the ants crosses the tolerance (or CLOSE_OUT_DISTANCE, if larger)
+        during the step, the ants are stopped at the crossing instead.
+        Once the stepping has ended above the tolerance, the rest is
+        covered by `_closeOut`.
+
+        Raises AntsReachedEndException if the ants are already within
+        the tolerance.
+        """
+        if self.getCurrentDistanceBetweenAnts() <= self.tolerance:
+            if self.endTime is None:
+                self.endTime = self.getCurrentTimeElapsed()
+            raise AntsReachedEndException
+        try:
+            dt = self._getDtForNextStep()
+        except AntsReachedEndException:
+            self._closeOut()
+            return
+        self.antGroup.setNextPositions(dt)
+        start = np.array(self.antGroup.getPositions())
+        end = np.array(self.antGroup.getNextPositions())
+        stepEnd = max(self.tolerance, self.CLOSE_OUT_DISTANCE)
+        if _distanceBetweenAnts(end) > stepEnd:
+            self.antGroup.advance(dt)
+            return
+        # the crossing lies within this step. Every ant moves along a
+        # straight line, so bisect on the fraction of the step at which
+        # the distance between the ants equals stepEnd.
+        lo, hi = 0., 1.
+        for _ in range(self.BISECTIONS):
+            mid = (lo + hi)/2
+            if _distanceBetweenAnts(start + mid*(end - start)) > stepEnd:
+                lo = mid
+            else:
+                hi = mid
+        timeElapsed = self.getCurrentTimeElapsed() + hi*dt
+        self.antGroup.setPositions(start + hi*(end - start), timeElapsed)
+        if stepEnd == self.tolerance:
+            self.endTime = timeElapsed
+
+    def _closeOut(self):
+        """
+        Moves the ants from CLOSE_OUT_DISTANCE to the tolerance on the
+        analytical solution. Stepping any further would take ever smaller
+        steps. The distance closes at a constant speed while the ants
+        spiral in on the center, so the end time includes a tail of
+        (CLOSE_OUT_DISTANCE - tolerance)/(v(1 - sin(a))) that doesn't come
+        from the stepped model.
+        """
+        n = self.antGroup.getNumberOfAnts()
+        distance = self.getCurrentDistanceBetweenAnts()
+        positions = np.array(self.getCurrentPositions())
+        center = positions.mean(axis=1, keepdims=True)
+        ratio = self.tolerance/distance
+        if ratio > 0:
+            # the ants form a shrinking polygon rotated by cot(pi/n)*ln(1/ratio)
+            theta = -log(ratio)/tan(pi/n)
+            rotation = np.array([[cos(theta), -sin(theta)],
+                                 [sin(theta), cos(theta)]])
+            positions = center + ratio*rotation.dot(positions - center)
+        else:
+            positions = np.repeat(center, n, axis=1)
+        timeElapsed = (self.getCurrentTimeElapsed() +
+                (distance - self.tolerance)/self._getClosingSpeed())
+        self.antGroup.setPositions(positions, timeElapsed)
+        self.endTime = timeElapsed
+
+    def estimateNumberOfFrames(self):
+        """
+        Estimates the number of frames the simulation will record from the
+        current state.
+
+        Every step moves each ant alpha of the distance to the ant in
+        front of it, which is turned by pi - a, with a the interior angle.
+        The ants keep forming a regular polygon, so every step shrinks the
+        distance between them by the same factor
+            |(1 - alpha) + alpha e^(i(pi - a))|
+        """
+        if self.alpha is None:
+            raise ValueError("Must set alpha first")
+        n = self.antGroup.getNumberOfAnts()
+        phi = Ngon(n).getInteriorAngle()
+        alpha = self.alpha
+        factor = sqrt((1 - alpha)**2 + alpha**2 -
+                2*alpha*(1 - alpha)*cos(phi))
+        distance = self.getCurrentDistanceBetweenAnts()
+        if distance <= self.tolerance:
+            return 1
+        # frame after the analytical tail below CLOSE_OUT_DISTANCE
+        tail = 1 if self.tolerance < self.CLOSE_OUT_DISTANCE else 0
+        stepEnd = max(self.tolerance, self.CLOSE_OUT_DISTANCE)
+        if distance <= stepEnd:
+            return 1 + tail
+        # the current frame, the full steps and the one cut at the crossing
+        return ceil(log(stepEnd/distance)/log(factor)) + 1 + tail
 
     def runSimulation(self):
         """
         Runs the simulation and accumulates the data points in an array
-        as it goes.
+        as it goes. The arrays are sized from `estimateNumberOfFrames` and
+        doubled if they still run out.
         """
+        if self.antGroup is None:
+            raise ValueError("You must set an antGroup for this simulation")
+
         n = self.antGroup.getNumberOfAnts()
         maxFrames = self.maxFrames
         skip = self.frameReductionFactor
 
-        if self.antGroup is None:
-            raise ValueError("You must set an antGroup for this simulation")
-
-        positions = np.zeros((n*maxFrames,2))
-        elapsedTimes = np.zeros(maxFrames)
-        distances = np.zeros(maxFrames)
-        for i in range(maxFrames):
+        size = int(self.estimateNumberOfFrames()*self.FRAME_MARGIN) + \
+            self.MIN_EXTRA_FRAMES
+        if maxFrames is not None:
+            size = min(size, maxFrames)
+        positions = np.zeros((n*size,2))
+        elapsedTimes = np.zeros(size)
+        distances = np.zeros(size)
+        self.endTime = None
+        i = 0
+        while True:
+            if i == size:
+                size *= 2
+                if maxFrames is not None:
+                    size = min(size, maxFrames)
+                positions = _grow(positions, n*size)
+                elapsedTimes = _grow(elapsedTimes, size)
+                distances = _grow(distances, size)
             x,y = self.getCurrentPositions()
             positions[i*n:(i+1)*n,0] = x
             positions[i*n:(i+1)*n,1] = y
             elapsedTimes[i] = self.getCurrentTimeElapsed()
             distances[i] = self.getCurrentDistanceBetweenAnts()
+            if self.endTime is not None or i+1 == maxFrames:
+                break
             try:
                 self._step()
             except AntsReachedEndException:
                 break
+            i += 1
         self.numFramesUsed = i+1
         self.elapsedTimes = elapsedTimes[:self.numFramesUsed:skip]
         self.distances = distances[:self.numFramesUsed:skip]
@@ -315,6 +525,14 @@ class SimulationManager:
     def getAllDistanceBetweenAnts(self):
         return self.distances
 
+    def getEndTime(self):
+        """
+        Returns the interpolated time at which the distance between the
+        ants crossed the tolerance, or None if the simulation ran out of
+        frames first.
+        """
+        return self.endTime
+
     def getNumberOfFramesUsed(self):
         return self.numFramesUsed
 
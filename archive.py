@@ -0,0 +1,274 @@
+"""
+Compact storage for the output of a SimulationManager.
+
+The ants spiral in on the center, so every frame is stored in polar
+form: the log of the radius and the angle of each ant, which change by
+a nearly constant amount from one step to the next, followed by the
+elapsed time and the log of the distance between the ants. Every value is
+quantized so that positions, times and distances are kept to within
+`resolution`, and replaced by its difference to the frame before. Frames
+are grouped into chunks that are compressed independently, each chunk
+starting with an absolute frame, so any frame can be read back by
+decompressing only its own chunk.
+
+File layout (an uncompressed .npz):
+    n: int
+        Number of ants
+    numFrames: int
+        Number of frames stored
+    resolution: float
+        Quantization step of the times, and largest error of the
+        positions and distances
+    polarStep: float
+        Quantization step of the log radii, angles and log distances
+    order: int
+        How many times the frames were differenced
+    chunkFrames: int
+        Number of frames per chunk
+    offsets: nd-array
+        Byte offset of each chunk in `data`, plus the total length
+    data: nd-array
+        The compressed chunks, one after the other. Each row of a chunk
+        holds log r0,...,log r(n-1),angle 0,...,angle (n-1),elapsed time,
+        log distance between ants
+    alpha,tolerance,endTime: float
+        Settings and result of the simulation, NaN when not set
+"""
+import zlib
+import numpy as np
+
+# default quantization step of the stored values
+RESOLUTION = 1e-6
+# default number of frames per chunk
+CHUNK_FRAMES = 256
+# number of times the frames are differenced. Log radii and angles change
+# by a nearly constant amount per step, so their first difference is
+# close to constant.
+ORDER = 1
+
+def saveArchive(simulationManager, path, resolution=RESOLUTION,
+        chunkFrames=CHUNK_FRAMES):
+    """
+    Writes the frames of a simulation that has been run to `path`
+
+    simulationManager: SimulationManager
+        Manager whose runSimulation has been called.
+    resolution: float
+        Positions, times and distances are kept to within this.
+    chunkFrames: int
+        Number of frames compressed together. Smaller chunks make seeking
+        cheaper but compress worse.
+    """
+    if resolution <= 0:
+        raise ValueError("Resolution must be > 0")
+    if int(chunkFrames) < 1:
+        raise ValueError("Chunk size must be >= 1")
+    chunkFrames = int(chunkFrames)
+    n = simulationManager.getAntGroup().getNumberOfAnts()
+    positions = np.asarray(simulationManager.getAllPositions()).reshape(-1,n,2)
+    times = simulationManager.getAllTimeElapsed()
+    distances = simulationManager.getAllDistanceBetweenAnts()
+
+    radii = np.hypot(positions[...,0], positions[...,1])
+    # a relative error of polarStep/2 in a radius or distance, or an error
+    # of polarStep/2 in an angle, is at most resolution/2
+    polarStep = resolution/max(radii.max(), distances.max(), resolution)
+    angles = np.unwrap(np.arctan2(positions[...,1], positions[...,0]), axis=0)
+    # radii and distances below the resolution are stored as the resolution
+    frames = np.column_stack([
+        np.log(np.maximum(radii, resolution))/polarStep,
+        angles/polarStep,
+        times/resolution,
+        np.log(np.maximum(distances, resolution))/polarStep])
+    frames = np.rint(frames).astype(np.int64)
+
+    chunks = []
+    for start in range(0, len(frames), chunkFrames):
+        chunks.append(_encodeChunk(frames[start:start+chunkFrames], ORDER))
+    offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+
+    def orNan(value):
+        return np.nan if value is None else value
+
+    # np.savez adds the extension if it's missing, so write to a file object
+    with open(path, 'wb') as f:
+        np.savez(f,
+            n=n,
+            numFrames=len(frames),
+            resolution=resolution,
+            polarStep=polarStep,
+            order=ORDER,
+            chunkFrames=chunkFrames,
+            offsets=offsets,
+            data=np.frombuffer(b''.join(chunks), dtype=np.uint8),
+            alpha=orNan(simulationManager.alpha),
+            tolerance=orNan(simulationManager.tolerance),
+            endTime=orNan(simulationManager.getEndTime()))
+
+def _encodeChunk(frames, order):
+    """
+    Compresses a block of quantized frames. `order` times, every frame but
+    the first is replaced by its difference to the frame before. The bytes
+    of the values are then grouped by significance, so that the mostly
+    zero high bytes of the small differences end up next to each other.
+    """
+    deltas = frames.copy()
+    for _ in range(order):
+        deltas[1:] = deltas[1:] - deltas[:-1]
+    raw = deltas.astype('<i8').view(np.uint8).reshape(-1, 8)
+    return zlib.compress(raw.T.tobytes(), 9)
+
+def _decodeChunk(data, numAnts, order):
+    """Inverse of `_encodeChunk`, returns one row per frame"""
+    raw = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    frames = raw.reshape(8, -1).T.copy().view('<i8').reshape(-1, 2*numAnts+2)
+    for _ in range(order):
+        frames = np.cumsum(frames, axis=0)
+    return frames
+
+def _grow(array, length):
+    """
+    Returns a copy of `array` extended with zeros to `length` rows
+    """
+    grown = np.zeros((length,) + array.shape[1:])
+    grown[:len(array)] = array
+    return grown
+
+class TrajectoryArchive:
+    """
+    Read access to a file written by `saveArchive`. Offers the same
+    getters as SimulationManager so it can replace one during replay.
+
+    n: int
+        Number of ants
+    numFrames: int
+        Number of frames stored
+    alpha,tolerance: float
+        Settings of the simulation, None when not set
+    endTime: float
+        Time at which the ants reached the tolerance, None if the
+        simulation ran out of frames first
+    """
+    def __init__(self, path):
+        def orNone(value):
+            value = float(value)
+            return None if np.isnan(value) else value
+
+        with np.load(path) as archive:
+            self.n = int(archive['n'])
+            self.numFrames = int(archive['numFrames'])
+            self.resolution = float(archive['resolution'])
+            self.polarStep = float(archive['polarStep'])
+            self.order = int(archive['order'])
+            self.chunkFrames = int(archive['chunkFrames'])
+            self.offsets = archive['offsets']
+            self.data = archive['data'].tobytes()
+            self.alpha = orNone(archive['alpha'])
+            self.tolerance = orNone(archive['tolerance'])
+            self.endTime = orNone(archive['endTime'])
+        # replay reads the trails from the first frame on, so the chunks
+        # 0..numDecoded-1 are decoded once into these arrays, which grow as
+        # replay advances
+        self._positions = np.zeros((0, 2))
+        self._times = np.zeros(0)
+        self._distances = np.zeros(0)
+        self._numDecoded = 0
+        # the most recently decoded chunk past the decoded ones, for seeking
+        self._chunkIndex = None
+        self._chunk = None
+
+    def _decode(self, chunkIndex):
+        """
+        Decompresses one chunk into its positions, times and distances
+        """
+        start, end = self.offsets[chunkIndex:chunkIndex+2]
+        frames = _decodeChunk(self.data[start:end], self.n, self.order)
+        n = self.n
+        radii = np.exp(frames[:,:n]*self.polarStep)
+        angles = frames[:,n:2*n]*self.polarStep
+        positions = np.stack([radii*np.cos(angles), radii*np.sin(angles)],
+                axis=-1).reshape(-1, 2)
+        times = frames[:,-2]*self.resolution
+        distances = np.exp(frames[:,-1]*self.polarStep)
+        return positions, times, distances
+
+    def _decodeUpTo(self, chunkIndex):
+        """Extends the decoded frames up to and including `chunkIndex`"""
+        n = self.n
+        needed = min((chunkIndex+1)*self.chunkFrames, self.numFrames)
+        if needed > len(self._times):
+            # double the room, so a replay copies every frame only a few times
+            size = min(max(needed, 2*len(self._times)), self.numFrames)
+            self._positions = _grow(self._positions, n*size)
+            self._times = _grow(self._times, size)
+            self._distances = _grow(self._distances, size)
+        for i in range(self._numDecoded, chunkIndex+1):
+            if i == self._chunkIndex:
+                positions, times, distances = self._chunk
+            else:
+                positions, times, distances = self._decode(i)
+            start = i*self.chunkFrames
+            end = start + len(times)
+            self._positions[start*n:end*n] = positions
+            self._times[start:end] = times
+            self._distances[start:end] = distances
+        self._numDecoded = max(self._numDecoded, chunkIndex+1)
+
+    def _getFrame(self, frameNumber):
+        """
+        Returns the positions, time and distance of one frame, decoding at
+        most its own chunk
+        """
+        if not 0 <= frameNumber < self.numFrames:
+            raise IndexError("Frame %d not in archive" % frameNumber)
+        n = self.n
+        chunkIndex = frameNumber // self.chunkFrames
+        if chunkIndex < self._numDecoded:
+            positions = self._positions[frameNumber*n:(frameNumber+1)*n]
+            return (positions, self._times[frameNumber],
+                    self._distances[frameNumber])
+        if chunkIndex != self._chunkIndex:
+            self._chunk = self._decode(chunkIndex)
+            self._chunkIndex = chunkIndex
+        i = frameNumber % self.chunkFrames
+        positions, times, distances = self._chunk
+        return positions[i*n:(i+1)*n], times[i], distances[i]
+
+    def getNumberOfAnts(self):
+        return self.n
+
+    def getNumFramesUsedAfterReduction(self):
+        return self.numFrames
+
+    def getEndTime(self):
+        return self.endTime
+
+    def getFramePositions(self, frameNumber):
+        """
+        Returns the (n,2) positions of the ants in one frame, decompressing
+        only the chunk that holds it
+        """
+        return self._getFrame(frameNumber)[0]
+
+    def getIthPositions(self, frameNumber):
+        """
+        Returns the positions of all the frames up to and including
+        `frameNumber`, like SimulationManager.getIthPositions. Only the
+        chunks not read before are decompressed.
+        """
+        frameNumber = min(frameNumber, self.numFrames-1)
+        self._decodeUpTo(frameNumber // self.chunkFrames)
+        return self._positions[:(frameNumber+1)*self.n]
+
+    def getIthXPositions(self, frameNumber):
+        return self.getIthPositions(frameNumber)[:,0]
+
+    def getIthYPositions(self, frameNumber):
+        return self.getIthPositions(frameNumber)[:,1]
+
+    def getIthTimeElapsed(self, frameNumber):
+        # same indexing as SimulationManager.getIthTimeElapsed
+        return self._getFrame((frameNumber-1) % self.numFrames)[1]
+
+    def getIthDistanceBetweenAnts(self, frameNumber):
+        return self._getFrame((frameNumber-1) % self.numFrames)[2]
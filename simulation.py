@@ -1,8 +1,10 @@
+import sys
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from math import pi,cos,sin,sqrt
 import numpy as np
 import ants
+import viewer
 
 def calcAnalyticalSolution():
     ngon = ants.Ngon(NUMBER_OF_ANTS)
@@ -17,13 +19,18 @@ INITIAL_DISTANCE_ORIGIN = 1
 if __name__ == "__main__":
     kwargs = {
         "antGroup": ants.AntGroup(NUMBER_OF_ANTS),
-        "maxFrames": 2**20,
         "frameReductionFactor": 2**7, 
         "alpha": 1/1000,
         }
     simulationManager = ants.SimulationManager(**kwargs)
     simulationManager.runSimulation()
 
+    if '--live' in sys.argv:
+        # play back in real time instead of rendering every frame to a gif
+        viewer.LiveViewer(simulationManager, fps=50,
+                expectedTime=calcAnalyticalSolution()).show()
+        sys.exit()
+
     def init():
         """initialize animation"""
         analy_text.set_text('Expected time = %.10f' % 
@@ -5,8 +5,13 @@ from math import pi,sqrt,sin,cos
 import matplotlib.pyplot as plt
 import math
 
+import os
+import tempfile
+
 import ants
+import archive
 import simulation as sim
+import viewer
 
 """
 d: int
@@ -244,5 +249,266 @@ class SimulationManagerTest(unittest.TestCase):
         assert_almost_equal(origPositions[0],xPositions)
         assert_almost_equal(origPositions[1],yPositions)
 
+    def testExactTermination(self):
+        n = 4
+        tolerance = 1/100
+        kwargs = {
+            "antGroup":ants.AntGroup(n),
+            "maxFrames":2**14,
+            "alpha": 1/10,
+            "tolerance": tolerance,
+            }
+        simManager = ants.SimulationManager(**kwargs)
+        simManager.runSimulation()
+        framesUsed = simManager.getNumFramesUsedAfterReduction()
+        times = simManager.getAllTimeElapsed()
+        distances = simManager.getAllDistanceBetweenAnts()
+        self.assertAlmostEqual(tolerance, distances[framesUsed-1])
+        self.assertEqual(simManager.getEndTime(), times[framesUsed-1])
+
+    def testEndTimeWithinLastStep(self):
+        n = sim.NUMBER_OF_ANTS
+        tolerance = 1/100
+        phi = ants.Ngon(n).getInteriorAngle()
+        closingSpeed = speed*(1 - sin(phi - pi/2))
+        expected = sim.calcAnalyticalSolution() - tolerance/closingSpeed
+        errors = []
+        for alpha in [1/2, 1/10, 1/100]:
+            kwargs = {
+                "antGroup":ants.AntGroup(n),
+                "alpha": alpha,
+                "tolerance": tolerance,
+                }
+            simManager = ants.SimulationManager(**kwargs)
+            simManager.runSimulation()
+            times = simManager.getAllTimeElapsed()
+            distances = simManager.getAllDistanceBetweenAnts()
+            endTime = simManager.getEndTime()
+            # the crossing happens during the step from the frame before
+            lastDt = alpha*distances[-2]/speed
+            self.assertGreater(endTime, times[-2])
+            self.assertLessEqual(endTime, times[-2] + lastDt)
+            errors.append(abs(endTime - expected))
+        # the stepped model converges on the analytical solution
+        self.assertTrue(errors[0] > errors[1] > errors[2])
+
+    def testZeroTolerance(self):
+        n = 4
+        kwargs = {
+            "antGroup":ants.AntGroup(n),
+            "maxFrames":2**14,
+            "alpha": 1/100,
+            "tolerance": 0,
+            }
+        simManager = ants.SimulationManager(**kwargs)
+        simManager.runSimulation()
+        framesUsed = simManager.getNumFramesUsedAfterReduction()
+        positions = simManager.getAllPositions()
+        times = simManager.getAllTimeElapsed()
+        distances = simManager.getAllDistanceBetweenAnts()
+        self.assertEqual(0, distances[-1])
+        assert_almost_equal(positions[(framesUsed-1)*n:], np.zeros((n,2)))
+        # the stepping stops at CLOSE_OUT_DISTANCE instead of taking ever
+        # smaller steps
+        closeOut = simManager.CLOSE_OUT_DISTANCE
+        self.assertAlmostEqual(closeOut, distances[-2])
+        self.assertGreater(distances[-3], closeOut)
+        # and the rest closes at speed v on the analytical solution
+        self.assertAlmostEqual(closeOut/speed,
+                simManager.getEndTime() - times[-2], places=10)
+        # distance between the ants closes at speed v, so takes d/v
+        self.assertAlmostEqual(sqrt(2)*d/speed, simManager.getEndTime(),
+                places=1)
+
+    def testEstimateNumberOfFrames(self):
+        for n in [3, 4, 16]:
+            kwargs = {
+                "antGroup":ants.AntGroup(n),
+                "alpha": 1/10,
+                }
+            simManager = ants.SimulationManager(**kwargs)
+            estimate = simManager.estimateNumberOfFrames()
+            simManager.runSimulation()
+            framesUsed = simManager.getNumberOfFramesUsed()
+            self.assertLessEqual(abs(estimate - framesUsed), 1)
+
+    def testGrowBuffers(self):
+        kwargs = {
+            "antGroup":ants.AntGroup(4),
+            "alpha": 1/100,
+            }
+        simManager = ants.SimulationManager(**kwargs)
+        simManager.runSimulation()
+        # start with buffers far too small so that they have to grow
+        kwargs["antGroup"] = ants.AntGroup(4)
+        grownManager = ants.SimulationManager(**kwargs)
+        grownManager.FRAME_MARGIN = 0.01
+        grownManager.MIN_EXTRA_FRAMES = 1
+        grownManager.runSimulation()
+        self.assertEqual(simManager.getNumberOfFramesUsed(),
+                grownManager.getNumberOfFramesUsed())
+        assert_almost_equal(simManager.getAllPositions(),
+                grownManager.getAllPositions())
+        assert_almost_equal(simManager.getAllTimeElapsed(),
+                grownManager.getAllTimeElapsed())
+        self.assertIsNotNone(grownManager.getEndTime())
+
+    def testNegativeTolerance(self):
+        self.assertRaises(ValueError, ants.SimulationManager,
+                ants.AntGroup(4), tolerance=-1)
+
+class ArchiveTest(unittest.TestCase):
+    n = 4
+    resolution = 1e-6
+
+    def setUp(self):
+        kwargs = {
+            "antGroup":ants.AntGroup(self.n),
+            "maxFrames":2**12,
+            "frameReductionFactor":2,
+            "alpha": 1/100,
+            }
+        self.simManager = ants.SimulationManager(**kwargs)
+        self.simManager.runSimulation()
+        fd, self.path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        archive.saveArchive(self.simManager, self.path,
+                resolution=self.resolution, chunkFrames=16)
+        self.archive = archive.TrajectoryArchive(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testNumFrames(self):
+        self.assertEqual(self.simManager.getNumFramesUsedAfterReduction(),
+                self.archive.getNumFramesUsedAfterReduction())
+
+    def testFramePositions(self):
+        n = self.n
+        positions = self.simManager.getAllPositions()
+        for i in [0, 15, 16, 17, self.archive.numFrames-1]:
+            assert_almost_equal(positions[i*n:(i+1)*n],
+                    self.archive.getFramePositions(i), decimal=6)
+        self.assertRaises(IndexError, self.archive.getFramePositions,
+                self.archive.numFrames)
+
+    def testIthGetters(self):
+        sm = self.simManager
+        for i in [0, 1, 20, sm.getNumFramesUsedAfterReduction()]:
+            assert_almost_equal(sm.getIthXPositions(i),
+                    self.archive.getIthXPositions(i), decimal=6)
+            assert_almost_equal(sm.getIthYPositions(i),
+                    self.archive.getIthYPositions(i), decimal=6)
+            self.assertAlmostEqual(sm.getIthTimeElapsed(i),
+                    self.archive.getIthTimeElapsed(i),
+                    delta=self.resolution)
+            self.assertAlmostEqual(sm.getIthDistanceBetweenAnts(i),
+                    self.archive.getIthDistanceBetweenAnts(i),
+                    delta=self.resolution)
+
+    def testCompression(self):
+        kwargs = {
+            "antGroup":ants.AntGroup(self.n),
+            "maxFrames":2**12,
+            "alpha": 1/1000,
+            }
+        simManager = ants.SimulationManager(**kwargs)
+        simManager.runSimulation()
+        archive.saveArchive(simManager, self.path)
+        raw = (simManager.getAllPositions().nbytes +
+            simManager.getAllTimeElapsed().nbytes +
+            simManager.getAllDistanceBetweenAnts().nbytes)
+        self.assertLess(os.path.getsize(self.path), raw/10)
+
+    def testCompressionReduced(self):
+        # the configuration simulation.py runs
+        kwargs = {
+            "antGroup":ants.AntGroup(sim.NUMBER_OF_ANTS),
+            "frameReductionFactor": 2**7,
+            "alpha": 1/1000,
+            }
+        simManager = ants.SimulationManager(**kwargs)
+        simManager.runSimulation()
+        archive.saveArchive(simManager, self.path)
+        raw = (simManager.getAllPositions().nbytes +
+            simManager.getAllTimeElapsed().nbytes +
+            simManager.getAllDistanceBetweenAnts().nbytes)
+        self.assertLess(os.path.getsize(self.path), raw/10)
+
+    def testSequentialReplayDecodesEachChunkOnce(self):
+        decoded = []
+        decode = self.archive._decode
+        def countingDecode(chunkIndex):
+            decoded.append(chunkIndex)
+            return decode(chunkIndex)
+        self.archive._decode = countingDecode
+        for i in range(self.archive.getNumFramesUsedAfterReduction()):
+            self.archive.getIthXPositions(i)
+            self.archive.getIthYPositions(i)
+            self.archive.getIthTimeElapsed(i)
+            self.archive.getIthDistanceBetweenAnts(i)
+        numChunks = len(self.archive.offsets) - 1
+        self.assertEqual(list(range(numChunks)), sorted(set(decoded)))
+        self.assertEqual(numChunks, len(decoded))
+
+    def testDecodedFramesGrowWithReplay(self):
+        # nothing is decoded up front
+        self.assertEqual(0, len(self.archive._times))
+        self.archive.getIthPositions(0)
+        self.assertEqual(self.archive.chunkFrames, len(self.archive._times))
+        last = self.archive.getNumFramesUsedAfterReduction() - 1
+        self.archive.getIthPositions(last)
+        self.assertEqual(last + 1, len(self.archive._times))
+
+    def testMetadata(self):
+        self.assertEqual(self.simManager.getEndTime(),
+                self.archive.getEndTime())
+        self.assertIsNotNone(self.archive.getEndTime())
+        self.assertEqual(self.simManager.alpha, self.archive.alpha)
+        self.assertEqual(self.simManager.tolerance, self.archive.tolerance)
+
+class LiveViewerTest(unittest.TestCase):
+    def setUp(self):
+        kwargs = {
+            "antGroup":ants.AntGroup(4),
+            "maxFrames":2**10,
+            "alpha": 1/100,
+            }
+        self.simManager = ants.SimulationManager(**kwargs)
+        self.simManager.runSimulation()
+        self.numFrames = self.simManager.getNumFramesUsedAfterReduction()
+
+    def testNoDropsWhenOnTime(self):
+        # the clock never moves, so every frame is drawn in time
+        liveViewer = viewer.LiveViewer(self.simManager, clock=lambda: 0)
+        frames = list(liveViewer.getFrameNumbers())
+        self.assertEqual(list(range(self.numFrames)), frames)
+        self.assertEqual(0, liveViewer.dropped)
+
+    def testDropsWhenLate(self):
+        # every frame takes a tenth of a second
+        ticks = iter(np.arange(0, 1000, 0.1))
+        liveViewer = viewer.LiveViewer(self.simManager, fps=50,
+                clock=lambda: next(ticks))
+        frames = list(liveViewer.getFrameNumbers())
+        self.assertGreater(liveViewer.dropped, 0)
+        self.assertEqual(self.numFrames, len(frames) + liveViewer.dropped)
+        self.assertEqual(self.numFrames-1, frames[-1])
+        self.assertTrue(all(np.diff(frames) > 0))
+
+    def testIntervalMakesUpForDrawCost(self):
+        fps = 50
+        draw = 0.012
+        now = [0.]
+        liveViewer = viewer.LiveViewer(self.simManager, fps=fps,
+                clock=lambda: now[0])
+        for _ in range(200):
+            liveViewer._measure()
+            # the timer waits for the interval, then the frame is drawn
+            now[0] += liveViewer.interval + draw
+        self.assertAlmostEqual(draw, liveViewer.drawCost, places=6)
+        self.assertAlmostEqual(1/fps - draw, liveViewer.interval, places=6)
+        self.assertAlmostEqual(1/fps, liveViewer.framePeriod, places=6)
+
 if __name__ == '__main__':
     unittest.main()
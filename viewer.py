@@ -0,0 +1,137 @@
+"""
+Interactive viewer that plays a simulation back in real time.
+
+Instead of drawing every frame, the viewer works out which frame is due
+on screen from the wall clock and the measured cost of drawing a frame,
+and skips the frames in between. Playback therefore keeps pace at the
+target frame rate however long the trails get.
+"""
+from time import perf_counter
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import simulation as sim
+
+class LiveViewer:
+    """
+    Plays back a simulation in an interactive window.
+
+    source: SimulationManager or TrajectoryArchive
+        Anything offering getNumFramesUsedAfterReduction and the
+        getIth... getters.
+    fps: float
+        Target number of frames shown per second.
+    expectedTime: float
+        Analytical solution to show alongside the elapsed time, optional.
+    dropped: int
+        Number of frames skipped so far to keep up with the clock.
+    drawCost: float
+        Smoothed wall clock time in seconds it takes to draw a frame.
+    framePeriod: float
+        Smoothed wall clock time in seconds between two drawn frames.
+    interval: float
+        Time in seconds the timer waits after a frame is drawn, so that
+        interval + drawCost adds up to 1/fps.
+    """
+    # weight of the newest measurement in the smoothed draw cost
+    SMOOTHING = 0.1
+
+    def __init__(self, source, fps=50, expectedTime=None, clock=perf_counter):
+        if fps <= 0:
+            raise ValueError("Frame rate must be > 0")
+        self.source = source
+        self.fps = fps
+        self.expectedTime = expectedTime
+        self.clock = clock
+        self.dropped = 0
+        self.drawCost = 0.
+        self.framePeriod = 1/fps
+        self.interval = 1/fps
+        self.animation = None
+        self._lastDraw = None
+        # last string set on each text artist
+        self._texts = {}
+
+    def getFrameNumbers(self):
+        """
+        Yields the number of the frame that should be drawn next, dropping
+        the frames that would be late by the time they reach the screen
+        """
+        # start so that the first frame is due when it's first drawn
+        start = self.clock() + self.drawCost
+        last = self.source.getNumFramesUsedAfterReduction() - 1
+        shown = -1
+        while shown < last:
+            # the frame that is due once this one has been drawn
+            due = int((self.clock() - start + self.drawCost)*self.fps)
+            frame = min(max(due, shown+1), last)
+            self.dropped += frame - shown - 1
+            shown = frame
+            yield frame
+
+    def _measure(self):
+        """
+        Updates the smoothed frame period and draw cost from the time since
+        the last frame, and shortens the timer interval by the draw cost
+        """
+        now = self.clock()
+        if self._lastDraw is not None:
+            period = now - self._lastDraw
+            self.framePeriod += self.SMOOTHING*(period - self.framePeriod)
+            # the period is the timer interval followed by the drawing
+            drawCost = max(period - self.interval, 0.)
+            self.drawCost += self.SMOOTHING*(drawCost - self.drawCost)
+            self.interval = max(1/self.fps - self.drawCost, 0.)
+            if self.animation is not None:
+                self.animation.event_source.interval = 1000*self.interval
+        self._lastDraw = now
+
+    def _setText(self, artist, text):
+        """Only touch the artist when the text actually changes"""
+        if self._texts.get(artist) != text:
+            artist.set_text(text)
+            self._texts[artist] = text
+
+    def _init(self):
+        self.dots.set_data([], [])
+        if self.expectedTime is not None:
+            self._setText(self.analyText,
+                    'Expected time = %.10f' % self.expectedTime)
+        return self.artists
+
+    def _animate(self, i):
+        self._measure()
+        self.dots.set_data(
+            self.source.getIthXPositions(i),
+            self.source.getIthYPositions(i)
+            )
+        self._setText(self.timeText, 'Elapsed time   = %.10f' %
+                self.source.getIthTimeElapsed(i))
+        self._setText(self.distanceText, 'Distance between ants = %.10f' %
+                self.source.getIthDistanceBetweenAnts(i))
+        self._setText(self.rateText, '%.0f fps, %d dropped' %
+                (1/self.framePeriod, self.dropped))
+        return self.artists
+
+    def show(self):
+        """Opens the window and blocks until it is closed"""
+        d = sim.INITIAL_DISTANCE_ORIGIN
+        fig = plt.figure()
+        ax = fig.add_subplot(111, aspect='equal', autoscale_on=False,
+                             xlim=(-d, d), ylim=(-d, d))
+        self.dots, = ax.plot([], 'bo', ms=.3)
+        self.analyText = ax.text(0.02, 0.95, '', transform=ax.transAxes)
+        self.timeText = ax.text(0.02, 0.90, '', transform=ax.transAxes)
+        self.distanceText = ax.text(0.02, 0.85, '', transform=ax.transAxes)
+        self.rateText = ax.text(0.02, 0.02, '', transform=ax.transAxes)
+        self.artists = (self.dots, self.analyText, self.timeText,
+                self.distanceText, self.rateText)
+
+        # keep a reference, otherwise the animation is garbage collected
+        self.animation = animation.FuncAnimation(fig, self._animate,
+            frames=self.getFrameNumbers,
+            interval=1000*self.interval,
+            blit=True,
+            init_func=self._init,
+            repeat=False,
+            cache_frame_data=False)
+        plt.show()